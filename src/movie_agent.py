@@ -1,12 +1,67 @@
 import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 from typing import Dict, List, Optional, Any, Tuple
 
 import google.generativeai as genai
+import orjson
 import requests
 from PIL import Image
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests_cache import DO_NOT_CACHE, CachedSession
+from urllib3.util.retry import Retry
 from src.config import TMDB_API_KEY
+from src.rate_limiter import TokenBucket
+from src.semantic_cache import SemanticCache
+
+# YouTube watch URL; video ids are always 11 characters
+_YT_RE = re.compile(r'youtube\.com/watch\?v=([A-Za-z0-9_-]{11})')
+
+# Leading words of a request ("Tell me about ...", "Recommend ..."); such a query is never a title itself
+REQUEST_WORDS = frozenset({"tell", "recommend", "suggest", "list", "give", "show"})
+
+# Leading words that mark a query as a question or request rather than a bare movie title
+_QUESTION_WORDS = frozenset({
+    "who", "what", "why", "how", "when", "where", "which", "is", "are", "do", "does",
+    "can", "could", "should"
+}) | REQUEST_WORDS
+
+# Maximum number of TMDB search/details responses kept in memory
+TMDB_CACHE_SIZE = 256
+
+# TMDB allows 40 requests per 10 seconds
+TMDB_RATE_LIMIT = 40
+TMDB_RATE_PER_SEC = 4
+TMDB_MAX_RATE_LIMIT_RETRIES = 2
+
+# On-disk HTTP cache lifetimes in seconds; only TMDB is cached, never the trailer web search
+HTTP_CACHE_URLS_EXPIRE_AFTER = {
+    "api.themoviedb.org/3/search/movie": 24 * 60 * 60,
+    "api.themoviedb.org/3/movie/": 7 * 24 * 60 * 60,
+    "image.tmdb.org/": 30 * 24 * 60 * 60,
+    "*": DO_NOT_CACHE,
+}
+
+# Maximum number of generated responses kept for reuse
+RESPONSE_CACHE_SIZE = 500
+
+# Formatting rules shared by every Gemini call, kept in one place instead of repeated in each prompt
+SYSTEM_INSTRUCTION = """
+You are a movie research assistant that helps people learn about films, cinema and entertainment.
+Format your responses in plain text with clear section divisions. DO NOT use markdown formatting.
+"""
+
+# How to answer a general (not single-movie) question; shared by the fused classification
+# prompt and generate_general_response
+GENERAL_ANSWER_INSTRUCTIONS = """
+Provide a helpful, informative response. If this is a question about movies in general
+(not about a specific film), provide relevant information about the topic.
+If you're not sure what the user is asking for, try to interpret their query in the context
+of movies, cinema, or entertainment.
+"""
 
 
 class MovieAgent:
@@ -17,46 +72,180 @@ class MovieAgent:
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
-        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash')
-
-    def process_user_query(self, query: str) -> Tuple[str, str]:
+        self.session = self._create_session()
+        self._bucket = TokenBucket(capacity=TMDB_RATE_LIMIT, refill_per_sec=TMDB_RATE_PER_SEC)
+        # Per-instance caches; failed requests raise and are therefore never cached
+        self._search_cached = lru_cache(maxsize=TMDB_CACHE_SIZE)(self._fetch_search)
+        self._details_cached = lru_cache(maxsize=TMDB_CACHE_SIZE)(self._fetch_details)
+        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=SYSTEM_INSTRUCTION)
+        # Generated answers: general queries are matched by meaning, movie summaries by TMDB id
+        self.general_cache = SemanticCache(max_entries=RESPONSE_CACHE_SIZE)
+        # Runs query embeddings alongside the Gemini classification call
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self.movie_response_cache: "OrderedDict[int, str]" = OrderedDict()
+
+    def _create_session(self) -> requests.Session:
+        """Create a shared HTTP session that reuses connections and caches responses on disk."""
+        session = CachedSession(
+            "tmdb_cache",
+            backend="sqlite",
+            use_cache_dir=True,
+            urls_expire_after=HTTP_CACHE_URLS_EXPIRE_AFTER,
+            allowable_codes=(200,),
+            allowable_methods=("GET",)
+        )
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=8,
+            # 429s are left to _tmdb_get so that every retry goes through the rate limiter
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=(500, 502, 503, 504),
+                              respect_retry_after_header=False)
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def warm_up_connections(self):
+        """Open pooled connections to the TMDB API and image hosts ahead of the first query."""
+        for url in (self.tmdb_base_url, "https://image.tmdb.org/t/p/w185"):
+            try:
+                self.session.head(url, timeout=5)
+            except requests.exceptions.RequestException as e:
+                print(f"Error warming up connection to {url}: {e}")
+
+    def process_user_query(self, query: str, callback=None, on_answer=None) -> Tuple[str, str]:
         """
         Process user query to determine if it's a movie search or a general question.
 
+        General questions are answered by the same Gemini call that classifies them; on_answer
+        is called once before the answer starts, then the answer is streamed to the callback.
+
         Returns:
-        Tuple of (query_type, refined_query) where query_type is either 'movie' or 'general'
+        Tuple of (query_type, text) where query_type is 'movie' (text is the movie title),
+        'answer' (text is the complete answer) or 'general' (Gemini returned nothing; text is
+        the original query, which still needs answering with generate_general_response)
         """
-        # Ask Gemini to classify the query
-        classification_prompt = f"""
-        Determine if the following query is asking about a specific movie or is a general question.
+        # Short title-like queries don't need a Gemini round trip
+        cheap_result = self._cheap_classify(query)
+        if cheap_result:
+            return cheap_result
 
-        Query: "{query}"
+        # Embed the query for the semantic cache while Gemini classifies it; movie queries never wait on it
+        query_vec_future = self._executor.submit(self.general_cache.embed, query)
 
-        If it's about a specific movie, respond with:
-        movie: [extracted movie title]
+        # Ask Gemini to classify the query and answer it directly if it's a general question
+        classification_prompt = f"""
+        Determine if the query below is asking about a specific movie or is a general question.
 
-        If it's a general question or request, respond with:
-        general: [original query]
+        If it's about a specific movie, respond only with:
+        movie: [extracted movie title]
 
-        Be very concise and only return one of the above formats.
+        If it's a general question or request, respond with "answer:" followed by your answer.
+        {GENERAL_ANSWER_INSTRUCTIONS}
+        Query: "{query}"
         """
 
+        answer_prefix = "answer:"
+        movie_prefix = "movie:"
+        response_text = ""
+        query_vec = None
+        answering = False
         try:
-            response = self.gemini_model.generate_content(classification_prompt)
-            result = response.text.strip().lower()
-
-            if result.startswith("movie:"):
-                return "movie", result.replace("movie:", "").strip()
-            else:
-                return "general", query
+            for chunk in self.gemini_model.generate_content(classification_prompt, stream=True):
+                piece = chunk.text
+                if answering:
+                    if not response_text:
+                        piece = piece.lstrip()
+                    response_text += piece
+                    if callback and piece:
+                        callback(piece)
+                    continue
+
+                response_text += piece
+                stripped = response_text.lstrip()
+                head = stripped.lower()
+                if head.startswith(answer_prefix):
+                    # Everything after the prefix is the answer itself
+                    answer_start = stripped[len(answer_prefix):].lstrip()
+                elif (len(head) >= len(movie_prefix) and not head.startswith(movie_prefix)
+                      and not answer_prefix.startswith(head)):
+                    # The model skipped the prefix and started answering directly
+                    answer_start = stripped
+                else:
+                    continue
+
+                # A paraphrase of an earlier question can reuse its answer instead of this stream
+                query_vec = query_vec_future.result()
+                cached = self.general_cache.lookup(query_vec) if query_vec is not None else None
+                if cached is not None:
+                    if on_answer:
+                        on_answer()
+                    if callback:
+                        callback(cached)
+                    return "answer", cached
+
+                answering = True
+                if on_answer:
+                    on_answer()
+                response_text = answer_start
+                if callback and response_text:
+                    callback(response_text)
+
+            if not answering:
+                result = response_text.strip()
+                if result.lower().startswith(movie_prefix):
+                    return "movie", result[len(movie_prefix):].strip().lower()
+                if not result:
+                    return "general", query
+
+                # A reply too short for the prefix check above is still a direct answer
+                if on_answer:
+                    on_answer()
+                if callback:
+                    callback(result)
+                response_text = result
+                query_vec = query_vec_future.result()
+
+            if query_vec is not None:
+                self.general_cache.add(query_vec, response_text)
+            return "answer", response_text
 
         except Exception as e:
             print(f"Error classifying query: {e}")
+            if answering:
+                # Part of the answer has already been streamed; keep it rather than starting over
+                return "answer", response_text
             # Default to treating it as a movie search if classification fails
             return "movie", query
 
+    def _cheap_classify(self, query: str) -> Optional[Tuple[str, str]]:
+        """Classify obvious movie-title queries locally; returns None when Gemini should decide."""
+        words = query.split()
+        if not words or len(words) > 4 or query.rstrip().endswith("?"):
+            return None
+        if words[0].lower() in _QUESTION_WORDS:
+            return None
+        return "movie", query
+
     def search_movie(self, query: str) -> Optional[Dict[str, Any]]:
         """Search for a movie using TMDB API."""
+        try:
+            return self._search_cached(query.strip().lower())
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            print(f"Error searching for movie: {e}")
+            return None
+
+    def get_movie_details(self, movie_id: int) -> Optional[Dict[str, Any]]:
+        """Get detailed information about a movie from TMDB."""
+        try:
+            return self._details_cached(movie_id)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            print(f"Error getting movie details: {e}")
+            return None
+
+    def _fetch_search(self, query: str) -> Optional[Dict[str, Any]]:
+        """Fetch the top TMDB search result for a normalized query."""
         url = f"{self.tmdb_base_url}/search/movie"
         params = {
             "api_key": TMDB_API_KEY,
@@ -65,21 +254,17 @@ class MovieAgent:
             "include_adult": "false"
         }
 
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
+        response = self._tmdb_get(url, params)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
 
-            if data["results"] and len(data["results"]) > 0:
-                return data["results"][0]
-            else:
-                return None
-        except requests.exceptions.RequestException as e:
-            print(f"Error searching for movie: {e}")
+        if data["results"] and len(data["results"]) > 0:
+            return data["results"][0]
+        else:
             return None
 
-    def get_movie_details(self, movie_id: int) -> Optional[Dict[str, Any]]:
-        """Get detailed information about a movie from TMDB."""
+    def _fetch_details(self, movie_id: int) -> Dict[str, Any]:
+        """Fetch full movie details from TMDB."""
         url = f"{self.tmdb_base_url}/movie/{movie_id}"
         params = {
             "api_key": TMDB_API_KEY,
@@ -87,27 +272,42 @@ class MovieAgent:
             "append_to_response": "credits,reviews,similar,videos"
         }
 
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error getting movie details: {e}")
-            return None
+        response = self._tmdb_get(url, params)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def _tmdb_get(self, url: str, params: Dict[str, Any]) -> requests.Response:
+        """GET a TMDB API endpoint within the rate limit, waiting out any 429 response."""
+        # Responses served from the disk cache don't touch TMDB, so they don't take a token
+        response = self.session.get(url, params=params, only_if_cached=True)
+        if response.status_code != 504:
+            return response
+
+        for attempt in range(TMDB_MAX_RATE_LIMIT_RETRIES + 1):
+            self._bucket.acquire()
+            response = self.session.get(url, params=params)
+            if response.status_code != 429 or attempt == TMDB_MAX_RATE_LIMIT_RETRIES:
+                return response
+
+            retry_after = response.headers.get("Retry-After", "")
+            time.sleep(int(retry_after) if retry_after.isdigit() else 1)
 
     def find_trailer(self, movie_title: str, year: Optional[str] = None, movie_data: Optional[Dict] = None) -> Optional[
         Dict[str, str]]:
-        # First try TMDB videos if available
-        if movie_data and "videos" in movie_data and movie_data["videos"]["results"]:
-            for video in movie_data["videos"]["results"]:
-                if video["site"] == "YouTube" and video["type"] == "Trailer":
-                    return {
-                        "title": f"{movie_title} Official Trailer",
-                        "url": f"https://www.youtube.com/watch?v={video['key']}",
-                        "video_id": video['key']
-                    }
-
-        # Web scraping approach as fallback
+        # First try TMDB videos, preferring official trailers, then the highest resolution
+        videos = (movie_data or {}).get("videos", {}).get("results", [])
+        youtube_videos = [video for video in videos if video.get("site") == "YouTube" and video.get("key")]
+        if youtube_videos:
+            youtube_videos.sort(key=lambda v: (v.get("type") != "Trailer", not v.get("official"), -v.get("size", 0)))
+            video = youtube_videos[0]
+            label = "Official Trailer" if video.get("type") == "Trailer" else video.get("type") or "Trailer"
+            return {
+                "title": f"{movie_title} {label}",
+                "url": f"https://www.youtube.com/watch?v={video['key']}",
+                "video_id": video['key']
+            }
+
+        # Web scraping approach as fallback when TMDB has no YouTube videos at all
         search_query = f"{movie_title} official trailer"
         if year:
             search_query += f" {year}"
@@ -115,27 +315,18 @@ class MovieAgent:
         try:
             # Use a search engine to find the trailer
             search_url = f"https://www.google.com/search?q={search_query}+site:youtube.com"
-            response = requests.get(search_url, headers=self.headers)
+            response = self.session.get(search_url)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.text, "html.parser")
-
-            # Extract YouTube links
-            youtube_links = []
-            for link in soup.find_all('a'):
-                href = link.get('href', '')
-                if 'youtube.com/watch' in href:
-                    match = re.search(r'youtube\.com/watch\?v=([^&]+)', href)
-                    if match:
-                        video_id = match.group(1)
-                        youtube_links.append({
-                            "title": f"{movie_title} Trailer",
-                            "url": f"https://www.youtube.com/watch?v={video_id}",
-                            "video_id": video_id
-                        })
-
-            if youtube_links:
-                return youtube_links[0]
+            # Take the first YouTube link straight from the raw HTML; no need to parse the page
+            match = _YT_RE.search(response.text)
+            if match:
+                video_id = match.group(1)
+                return {
+                    "title": f"{movie_title} Trailer",
+                    "url": f"https://www.youtube.com/watch?v={video_id}",
+                    "video_id": video_id
+                }
 
             return None
         except Exception as e:
@@ -148,10 +339,13 @@ class MovieAgent:
             return None
 
         try:
-            poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
-            response = requests.get(poster_url)
+            poster_url = f"https://image.tmdb.org/t/p/w185{poster_path}"
+            response = self.session.get(poster_url)
             response.raise_for_status()
-            return Image.open(BytesIO(response.content))
+            image = Image.open(BytesIO(response.content))
+            # Image.open is lazy; decode now so a corrupt poster is caught here
+            image.load()
+            return image
         except Exception as e:
             print(f"Error fetching poster: {e}")
             return None
@@ -159,6 +353,13 @@ class MovieAgent:
     def generate_movie_response(self, movie_data: Dict[str, Any], trailer_info: Optional[Dict[str, str]],
                                 streaming: bool = False, callback=None) -> str:
         """Generate a comprehensive response about a movie using Gemini API with streaming support."""
+        movie_id = movie_data.get("id")
+        cached = self.movie_response_cache.get(movie_id)
+        if cached is not None:
+            if callback:
+                callback(cached)
+            return cached
+
         # Create structured context for Gemini
         context = {
             "title": movie_data.get("title", "Unknown"),
@@ -170,12 +371,14 @@ class MovieAgent:
             "budget": movie_data.get("budget", 0),
             "revenue": movie_data.get("revenue", 0),
             "director": self._get_director(movie_data),
-            "cast": self._get_cast(movie_data),
+            "cast": self._get_cast(movie_data, limit=5),
             "trailer": trailer_info["url"] if trailer_info else "Trailer not available"
         }
 
         prompt = f"""
-        Based on the following movie information, create a comprehensive and engaging summary:
+        Based on the following movie information, create a comprehensive and engaging summary.
+        Provide insights about the movie's reception, significance, and interesting facts if applicable.
+        Format the response in a clear, professional way for someone interested in learning about this movie.
 
         Title: {context['title']}
         Release Date: {context['release_date']}
@@ -183,7 +386,7 @@ class MovieAgent:
         Genres: {', '.join(context['genres'])}
         Rating: {context['vote_average']}/10
         Director: {context['director']}
-        Main Cast: {', '.join(context['cast'][:5])}
+        Main Cast: {', '.join(context['cast'])}
 
         Overview: {context['overview']}
 
@@ -191,10 +394,6 @@ class MovieAgent:
         Revenue: ${context['revenue']:,}
 
         Trailer: {context['trailer']}
-
-        Provide insights about the movie's reception, significance, and interesting facts if applicable.
-        Format the response in a clear, professional way for someone interested in learning about this movie.
-        DO NOT use markdown formatting. Use plain text formatting with clear section divisions.
         """
 
         try:
@@ -205,11 +404,10 @@ class MovieAgent:
                     piece = chunk.text
                     response_text += piece
                     callback(piece)  # Send chunk to callback
-                return response_text
             else:
                 # For non-streaming response
                 response = self.gemini_model.generate_content(prompt)
-                return response.text
+                response_text = response.text
         except Exception as e:
             print(f"Error generating response with Gemini: {e}")
             # Fall back to formatted response if Gemini fails
@@ -218,18 +416,24 @@ class MovieAgent:
                 callback(fallback)
             return fallback
 
+        if movie_id is not None:
+            self.movie_response_cache[movie_id] = response_text
+            if len(self.movie_response_cache) > RESPONSE_CACHE_SIZE:
+                self.movie_response_cache.popitem(last=False)
+        return response_text
+
     def generate_general_response(self, query: str, streaming: bool = False, callback=None) -> str:
         """Generate a response for general queries using Gemini API."""
+        query_vec = self.general_cache.embed(query)
+        cached = self.general_cache.lookup(query_vec) if query_vec is not None else None
+        if cached is not None:
+            if callback:
+                callback(cached)
+            return cached
+
         prompt = f"""
+        {GENERAL_ANSWER_INSTRUCTIONS}
         The user has asked: "{query}"
-
-        Please provide a helpful, informative response. If this is a question about movies in general
-        (not about a specific film), provide relevant information about the topic.
-
-        If you're not sure what the user is asking for, try to interpret their query in the context
-        of movies, cinema, or entertainment.
-
-        Format your response in plain text with clear section divisions. DO NOT use markdown formatting.
         """
 
         try:
@@ -240,11 +444,10 @@ class MovieAgent:
                     piece = chunk.text
                     response_text += piece
                     callback(piece)  # Send chunk to callback
-                return response_text
             else:
                 # For non-streaming response
                 response = self.gemini_model.generate_content(prompt)
-                return response.text
+                response_text = response.text
         except Exception as e:
             print(f"Error generating general response with Gemini: {e}")
             fallback = f"I'm sorry, I couldn't process your query: '{query}'. Please try asking in a different way."
@@ -252,16 +455,20 @@ class MovieAgent:
                 callback(fallback)
             return fallback
 
+        if query_vec is not None:
+            self.general_cache.add(query_vec, response_text)
+        return response_text
+
     def _get_director(self, movie_data: Dict[str, Any]) -> str:
         """Extract director name from movie data."""
         crew = movie_data.get("credits", {}).get("crew", [])
         directors = [member["name"] for member in crew if member["job"] == "Director"]
         return directors[0] if directors else "Unknown"
 
-    def _get_cast(self, movie_data: Dict[str, Any]) -> List[str]:
-        """Extract cast names from movie data."""
+    def _get_cast(self, movie_data: Dict[str, Any], limit: int = 5) -> List[str]:
+        """Extract the top-billed cast names from movie data."""
         cast = movie_data.get("credits", {}).get("cast", [])
-        return [member["name"] for member in cast]
+        return [member["name"] for member in cast[:limit] if member.get("name")]
 
     def _create_fallback_response(self, context: Dict[str, Any]) -> str:
         """Create a formatted response if Gemini API fails."""
@@ -277,7 +484,7 @@ class MovieAgent:
 
         Cast & Crew:
         Director: {context['director']}  
-        Starring: {', '.join(context['cast'][:5])}
+        Starring: {', '.join(context['cast'])}
 
         Watch Trailer:
         {context['trailer']}
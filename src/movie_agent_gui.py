@@ -1,11 +1,22 @@
 import threading
 import tkinter as tk
 import webbrowser
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import ttk, scrolledtext
 
 from PIL import Image, ImageTk
 
-from src.movie_agent import MovieAgent
+from src.movie_agent import MovieAgent, REQUEST_WORDS
+
+# Interval in milliseconds at which streamed text is flushed into the info area
+STREAM_FLUSH_MS = 50
+
+# Display size of the poster in the side panel
+POSTER_SIZE = (180, 270)
+
+# Number of rendered posters kept so revisited movies don't refetch them
+POSTER_CACHE_SIZE = 32
 
 
 class MovieAgentGUI:
@@ -19,10 +30,19 @@ class MovieAgentGUI:
         self.root.resizable(True, True)
 
         self.agent = MovieAgent()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        # Do the TCP/TLS handshakes while the user is still typing
+        self.executor.submit(self.agent.warm_up_connections)
         self.trailer_info = None
         self.current_movie = None
         self.last_query_type = None
         self.last_query = None
+        self._poster_cache = OrderedDict()
+
+        # Streamed text is buffered by worker threads and written to the UI in batches
+        self._pending_buf = []
+        self._buf_lock = threading.Lock()
+        self._flush_scheduled = False
 
         self.setup_ui()
 
@@ -107,22 +127,43 @@ class MovieAgentGUI:
 
     def _handle_query(self, query):
         """Handle query processing in background thread."""
-        # Determine query type
-        query_type, refined_query = self.agent.process_user_query(query)
+        # Search TMDB speculatively while the query is being classified. Questions ending in "?"
+        # and requests ("Tell me about ...") are never used as a title verbatim, so their search
+        # result would always be discarded
+        words = query.split()
+        search_future = None
+        if not query.rstrip().endswith("?") and words[0].lower() not in REQUEST_WORDS:
+            search_future = self.executor.submit(self.agent.search_movie, query)
+
+        # Determine query type; general questions may be answered (and streamed) right away
+        query_type, refined_query = self.agent.process_user_query(
+            query,
+            callback=self._queue_text,
+            on_answer=lambda: self._start_general_answer(query)
+        )
         self.last_query_type = query_type
         self.last_query = query
 
+        if query_type == "movie" and search_future and refined_query.strip().lower() == query.strip().lower():
+            self._search_movie(refined_query, search_future)
+            return
+
+        if search_future:
+            search_future.cancel()
+
         if query_type == "movie":
             self._search_movie(refined_query)
+        elif query_type == "answer":
+            self.root.after(0, self._finish_stream)
         else:
             self._answer_general_query(query)
 
-    def _search_movie(self, query):
-        """Search for movie information."""
+    def _search_movie(self, query, search_future=None):
+        """Search for movie information, reusing a search already in flight if given."""
         self.show_status(f"Searching for movie: {query}")
 
         # Search for movie
-        movie = self.agent.search_movie(query)
+        movie = search_future.result() if search_future else self.agent.search_movie(query)
         if not movie:
             self.show_status(f"Movie not found: {query}")
             self._handle_movie_not_found(query)
@@ -130,6 +171,12 @@ class MovieAgentGUI:
 
         self.show_status(f"Found: {movie['title']} - Getting details...")
 
+        # The search result already has the poster path, so download it while details load
+        poster_path = movie.get("poster_path")
+        poster_future = None
+        if poster_path not in self._poster_cache:
+            poster_future = self.executor.submit(self.agent.get_poster_image, poster_path)
+
         # Get detailed information
         movie_details = self.agent.get_movie_details(movie["id"])
         if not movie_details:
@@ -139,18 +186,17 @@ class MovieAgentGUI:
 
         self.current_movie = movie_details
 
-        # Find trailer
+        # Find trailer while the poster finishes downloading
         release_year = movie["release_date"][:4] if movie.get("release_date") else None
         trailer = self.agent.find_trailer(movie["title"], release_year, movie_details)
         self.trailer_info = trailer
-
-        # Load poster
-        poster_image = None
-        if movie_details.get("poster_path"):
-            poster_image = self.agent.get_poster_image(movie_details["poster_path"])
+        poster_image = poster_future.result() if poster_future else None
+        if poster_image:
+            # Fit the already-decoded poster here so the Tk thread only builds the PhotoImage
+            poster_image.thumbnail(POSTER_SIZE, Image.BILINEAR)
 
         # Update UI in main thread
-        self.root.after(0, lambda: self._update_ui_for_movie(movie_details, trailer, poster_image))
+        self.root.after(0, lambda: self._update_ui_for_movie(movie_details, trailer, poster_path, poster_image))
 
         # Generate response with streaming
         self.show_status(f"Generating information about {movie_details['title']}...")
@@ -158,8 +204,9 @@ class MovieAgentGUI:
             movie_details,
             trailer,
             streaming=True,
-            callback=lambda text: self.root.after(0, lambda: self._append_text(text))
+            callback=self._queue_text
         )
+        self.root.after(0, self._finish_stream)
 
     def _handle_movie_not_found(self, query):
         """Handle when a movie search returns no results."""
@@ -167,21 +214,26 @@ class MovieAgentGUI:
         self.show_status(f"Treating '{query}' as a general question...")
         self._answer_general_query(query)
 
-    def _answer_general_query(self, query):
-        """Handle general questions with Gemini."""
+    def _start_general_answer(self, query):
+        """Show the general-query UI before its answer starts streaming."""
         self.show_status(f"Answering: {query}")
 
         # Update UI for general query (hide movie-specific elements)
         self.root.after(0, lambda: self._update_ui_for_general_query(query))
 
+    def _answer_general_query(self, query):
+        """Handle general questions with Gemini."""
+        self._start_general_answer(query)
+
         # Generate response with streaming
         self.agent.generate_general_response(
             query,
             streaming=True,
-            callback=lambda text: self.root.after(0, lambda: self._append_text(text))
+            callback=self._queue_text
         )
+        self.root.after(0, self._finish_stream)
 
-    def _update_ui_for_movie(self, movie_details, trailer, poster_image):
+    def _update_ui_for_movie(self, movie_details, trailer, poster_path, poster_image):
         """Update UI with movie details."""
         # Update title
         title_text = f"{movie_details['title']}"
@@ -189,11 +241,18 @@ class MovieAgentGUI:
             title_text += f" ({movie_details['release_date'][:4]})"
         self.title_label.config(text=title_text)
 
-        # Update poster
-        if poster_image:
-            # Resize poster to fit
-            poster_image = poster_image.resize((180, 270), Image.LANCZOS)
+        # Update poster, reusing the rendered image if this movie was shown before
+        photo = self._poster_cache.get(poster_path)
+        if photo is not None:
+            self._poster_cache.move_to_end(poster_path)
+        elif poster_image:
+            # The poster has already been decoded and sized off the Tk thread
             photo = ImageTk.PhotoImage(poster_image)
+            self._poster_cache[poster_path] = photo
+            if len(self._poster_cache) > POSTER_CACHE_SIZE:
+                self._poster_cache.popitem(last=False)
+
+        if photo is not None:
             self.poster_label.config(image=photo, text="")
             self.poster_label.image = photo  # Keep reference
         else:
@@ -215,6 +274,30 @@ class MovieAgentGUI:
         self.trailer_button.config(state=tk.DISABLED)
         self.search_button.config(state=tk.NORMAL)
 
+    def _queue_text(self, text):
+        """Buffer streamed text and schedule a flush if one isn't already pending."""
+        with self._buf_lock:
+            self._pending_buf.append(text)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self.root.after(STREAM_FLUSH_MS, self._flush_stream)
+
+    def _flush_stream(self):
+        """Write all buffered text to the info area in a single update."""
+        with self._buf_lock:
+            text = "".join(self._pending_buf)
+            self._pending_buf.clear()
+            self._flush_scheduled = False
+
+        if text:
+            self._append_text(text)
+
+    def _finish_stream(self):
+        """Flush any remaining streamed text and mark the response as complete."""
+        self._flush_stream()
+        self.show_status("Ready")
+
     def _append_text(self, text):
         """Append text to the info area."""
         # Update text view
@@ -223,11 +306,10 @@ class MovieAgentGUI:
         self.info_text.see(tk.END)
         self.info_text.config(state=tk.DISABLED)
 
-        if text:
-            self.show_status("Ready")
-
     def clear_info(self):
         """Clear information display."""
+        with self._buf_lock:
+            self._pending_buf.clear()
         self.info_text.config(state=tk.NORMAL)
         self.info_text.delete(1.0, tk.END)
         self.info_text.config(state=tk.DISABLED)
@@ -0,0 +1,28 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket that blocks callers once the request budget is spent."""
+
+    def __init__(self, capacity: int, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_sec)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.refill_per_sec
+
+            time.sleep(wait)
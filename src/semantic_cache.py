@@ -0,0 +1,68 @@
+import threading
+from functools import lru_cache
+from typing import List, Optional
+
+import google.generativeai as genai
+import numpy as np
+
+
+class SemanticCache:
+    """In-memory cache of Gemini responses matched by query meaning rather than exact text."""
+
+    def __init__(self, max_entries: int = 500, threshold: float = 0.92,
+                 embedding_model: str = "models/text-embedding-004"):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+        self.cache_vecs: Optional[np.ndarray] = None
+        self.cache_responses: List[str] = []
+        self._next_slot = 0
+        self._lock = threading.Lock()
+        # The same query is often embedded more than once (classification, then the general answer);
+        # failed calls raise and are therefore never cached
+        self._embed_cached = lru_cache(maxsize=max_entries)(self._fetch_embedding)
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """Return the unit-length embedding of a query, or None if it can't be computed."""
+        try:
+            return self._embed_cached(text)
+        except Exception as e:
+            print(f"Error embedding query: {e}")
+            return None
+
+    def _fetch_embedding(self, text: str) -> Optional[np.ndarray]:
+        """Embed a query with Gemini and normalise it to unit length."""
+        result = genai.embed_content(model=self.embedding_model, content=text,
+                                     task_type="semantic_similarity")
+        vec = np.asarray(result["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def lookup(self, vec: np.ndarray) -> Optional[str]:
+        """Return the cached response closest to the embedding if it is similar enough."""
+        with self._lock:
+            count = len(self.cache_responses)
+            if not count:
+                return None
+
+            sims = self.cache_vecs[:count] @ vec
+            best = int(np.argmax(sims))
+            if sims[best] > self.threshold:
+                return self.cache_responses[best]
+            return None
+
+    def add(self, vec: np.ndarray, response: str):
+        """Store a response, evicting the oldest entry once the cache is full."""
+        with self._lock:
+            if self.cache_vecs is None:
+                self.cache_vecs = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+
+            if len(self.cache_responses) < self.max_entries:
+                slot = len(self.cache_responses)
+                self.cache_responses.append(response)
+            else:
+                slot = self._next_slot
+                self.cache_responses[slot] = response
+                self._next_slot = (slot + 1) % self.max_entries
+
+            self.cache_vecs[slot] = vec